@@ -6,35 +6,45 @@ A99000241
 This module provides a function to solve for a given problem size multiple times
 with all available processors.
 """
+import os
+import time
+import ctypes
 import numpy as np
 import multiprocessing
 from solver import Solver
 
-def _initialize_worker(height, width):
-	"""Initialize a solver for each worker process
+def _initialize_worker(height, width, results):
+	"""Initialize a solver for each worker process. Each solver is seeded
+	with its process id and the time, so workers never share a random stream.
 
 	Args:
 	    height (int): The height of the problem size
 	    width (int): The width of the problem size
+	    results (RawArray): Shared array the results are written to
 	"""
-	global solver
-	solver = Solver(height, width)
+	global solver, shared_results
+	solver = Solver(height, width, seed=os.getpid() ^ time.time_ns())
+	shared_results = results
 
-def _solve_once_multiprocessing(_):
-	"""Run the solver once and return the result
+def _solve_once_multiprocessing(index):
+	"""Run the solver once and write the result to the shared array
 
 	Args:
-	    _ (Any Type): Ignored. This is the input value from imap_unordered
-
-	Returns:
-	    int: The number of towers to provide full coverage
+	    index (int): The index of the result. This is the input value from map
 	"""
-	global solver
-	return solver.solve_once()
+	global solver, shared_results
+	shared_results[index] = solver.solve_once()
 
 def solve_multiprocessing(height, width, times):
 	"""Solve for a given problem size multiple times with all processors.
 
+	Results are written by the workers directly into shared memory instead of
+	being sent back through the pool's pipe.
+
+	Workers are not forked from this process: the threading layer used by
+	Solver.solve is not fork-safe, so a forked pool can hang at exit once
+	Solver.solve has run.
+
 	Args:
 	    height (int): The height of the problem size
 	    width (int): The width of the problem size
@@ -43,10 +53,16 @@ def solve_multiprocessing(height, width, times):
 	Returns:
 	    np.array: An array of results
 	"""
-	pool = multiprocessing.Pool(initializer=_initialize_worker,
-		initargs=(height, width))
-	results = np.empty(times, dtype=np.int)
-	for index, result in enumerate(pool.imap_unordered(_solve_once_multiprocessing, xrange(times))):
-		results[index] = result
+	if "forkserver" in multiprocessing.get_all_start_methods():
+		context = multiprocessing.get_context("forkserver")
+	else:
+		context = multiprocessing.get_context("spawn")
+	results = context.RawArray(ctypes.c_int32, times)
+	pool = context.Pool(initializer=_initialize_worker,
+		initargs=(height, width, results))
+	# Send tasks in batches so that each worker gets a few of them
+	chunksize = max(1, times // (multiprocessing.cpu_count() * 8))
+	pool.map(_solve_once_multiprocessing, range(times), chunksize=chunksize)
 	pool.close()
-	return results
+	pool.join()
+	return np.frombuffer(results, dtype=np.int32)
@@ -4,13 +4,151 @@ Jinzhe Zhang
 A99000241
 
 Provides Solver class as a wrapper/container/handle for the entire problem.
+solve_once_nb is a compiled version of the whole simulation used by
+Solver.solve_once, and solve_many_nb runs it on all cores for Solver.solve.
 
 """
-import random
-import matplotlib
 import numpy as np
-import matplotlib.pyplot as plt
-from tower import Tower
+from numba import njit, prange, get_num_threads
+from tower import Tower, _trim_kernel
+
+@njit(cache=True)
+def _random_uint64(rng_state):
+	"""Advance a xoroshiro128+ generator and return its next output
+
+	Args:
+	    rng_state (np.ndarray): Two uint64 words of generator state. Updated in
+	                            place.
+
+	Returns:
+	    np.uint64: A uniformly distributed 64-bit integer
+	"""
+	s0 = rng_state[0]
+	s1 = rng_state[1]
+	result = s0 + s1
+	s1 ^= s0
+	rng_state[0] = ((s0 << np.uint64(55)) | (s0 >> np.uint64(9))) ^ s1 ^ (s1 << np.uint64(14))
+	rng_state[1] = (s1 << np.uint64(36)) | (s1 >> np.uint64(28))
+	return result
+
+@njit(cache=True)
+def _randint(rng_state, low, high):
+	"""Compiled counterpart of random.randint
+
+	The modulo bias is far below 2^-50 for any realistic problem size and is
+	ignored.
+
+	Args:
+	    rng_state (np.ndarray): State passed to _random_uint64
+	    low (int): Lower bound, inclusive
+	    high (int): Upper bound, inclusive
+
+	Returns:
+	    int: A random integer in [low, high]
+	"""
+	return low + np.int64(_random_uint64(rng_state) % np.uint64(high - low + 1))
+
+@njit(cache=True)
+def _has_free_cell(sub_free):
+	"""Check if any cell of sub_free is uncovered. Stops at the first one.
+
+	Args:
+	    sub_free (np.ndarray): A 2D view of the free mask
+
+	Returns:
+	    bool: Whether any cell is non-zero
+	"""
+	for row in sub_free:
+		for item in row:
+			if item:
+				return True
+	return False
+
+@njit(cache=True, nogil=True)
+def solve_once_nb(coverage, free_mask, tower_coords, height, width, rng_state):
+	"""Solve the problem once without creating any Tower objects.
+
+	This is Solver.generate_random_valid_tower_trimmed followed by
+	Solver.add_tower in a loop.
+
+	Args:
+	    coverage (np.ndarray): Coverage buffer of shape (height, width). It is
+	                           cleared first and holds the ranks on return.
+	    free_mask (np.ndarray): Free mask buffer of shape (height, width). It
+	                            is reset first.
+	    tower_coords (np.ndarray): Buffer of shape (height * width, 4). Row
+	                               rank - 1 receives x1, x2, y1, y2 of the
+	                               tower of that rank.
+	    height (int): The height of the problem size
+	    width (int): The width of the problem size
+	    rng_state (np.ndarray): Two uint64 words of generator state
+
+	Returns:
+	    int: Number of tower used to cover the entire space.
+	"""
+	coverage[:, :] = 0
+	free_mask[:, :] = 1
+
+	# Buffers for trim, shared by all towers
+	cache = np.empty(width, dtype=np.int64)
+	stack_x = np.empty(width + 1, dtype=np.int64)
+	stack_h = np.empty(width + 1, dtype=np.int64)
+
+	num_tower = 0
+	uncovered_count = height * width
+	while uncovered_count > 0:
+		# Generate a random tower whose area is not totally covered yet
+		while True:
+			w = _randint(rng_state, 1, width)
+			x1 = _randint(rng_state, 0, width - w)
+			h = _randint(rng_state, 1, height)
+			y1 = _randint(rng_state, 0, height - h)
+			if _has_free_cell(free_mask[y1:y1 + h, x1:x1 + w]):
+				break
+
+		# Trim it
+		max_x1, max_x2, max_y1, max_y2, max_area = _trim_kernel(
+			free_mask[y1:y1 + h, x1:x1 + w], cache[:w], stack_x, stack_h)
+
+		# Add it to the solution
+		x1, x2 = x1 + max_x1, x1 + max_x2
+		y1, y2 = y1 + max_y1, y1 + max_y2
+		tower_coords[num_tower, 0] = x1
+		tower_coords[num_tower, 1] = x2
+		tower_coords[num_tower, 2] = y1
+		tower_coords[num_tower, 3] = y2
+		num_tower += 1
+		coverage[y1:y2, x1:x2] = num_tower
+		free_mask[y1:y2, x1:x2] = 0
+		uncovered_count -= max_area
+
+	return num_tower
+
+@njit(cache=True, parallel=True)
+def solve_many_nb(coverage, height, width, rng_states, results, num_chunks):
+	"""Solve the problem results.size times with solve_once_nb, in parallel.
+
+	Each run has its own generator, so the results do not depend on how the
+	runs are split. Each chunk of runs owns its buffers, so chunks can run on
+	different threads.
+
+	Args:
+	    coverage (np.ndarray): A coverage buffer. Only its shape and dtype are
+	                           used, for the buffers of the chunks
+	    height (int): The height of the problem size
+	    width (int): The width of the problem size
+	    rng_states (np.ndarray): Generator states of shape (results.size, 2)
+	    results (np.ndarray): Receives the number of towers of each run
+	    num_chunks (int): Number of chunks, usually the number of threads
+	"""
+	times = results.size
+	for chunk in prange(num_chunks):
+		chunk_coverage = np.empty_like(coverage)
+		free_mask = np.empty((height, width), dtype=np.uint8)
+		tower_coords = np.empty((height * width, 4), dtype=np.int32)
+		for index in range(chunk, times, num_chunks):
+			results[index] = solve_once_nb(chunk_coverage, free_mask,
+				tower_coords, height, width, rng_states[index])
 
 class Solver:
 	"""docstring for Solver
@@ -18,27 +156,71 @@ class Solver:
 	Attributes:
 	    coverage (np.ndarray): The current coverage. 0 means uncovered, other
 	                           values means covered by the tower of that rank
+	    free_mask (np.ndarray): 1 where coverage is 0, else 0. Kept as uint8
+	                            for the scans in the hot path
 	    height (int): The height of the problem size
 	    width (int): The width of the problem size
 	    num_tower (int): Number of online towers
-	    tower_list (list): A list of online towers
+	    tower_coords (np.ndarray): x1, x2, y1, y2 of the online towers. Row
+	                               rank - 1 is the tower of that rank. Only
+	                               the first num_tower rows are valid.
+	    tower_list (list): Read-only. New Tower objects are built from
+	                       tower_coords on every access, so they are not the
+	                       objects passed to add_tower, and changing the list
+	                       does not change the solution
+	    uncovered_count (int): Number of cells not covered yet
 	"""
-	def __init__(self, height, width):
+	def __init__(self, height, width, seed=None):
 		"""Initialize a solver
 
 		Args:
 		    height (int): Height of the rectangle
 		    width (int): Width of the rectangle
+		    seed (int, optional): Seed of the random numbers. See seed.
 		"""
 		self.height = int(height)
 		self.width = int(width)
 
+		self.seed(seed)
+
+		# Buffers are allocated once and reused by clear.
+		# Ranks never exceed the number of cells. 16 bits are enough for the
+		# usual problem sizes and keep the scans over coverage cheap.
+		if self.height * self.width <= np.iinfo(np.uint16).max:
+			dtype = np.uint16
+		else:
+			dtype = np.uint32
+		self.coverage = np.zeros((self.height, self.width), dtype=dtype)
+		self.free_mask = np.ones((self.height, self.width), dtype=np.uint8)
+		# A solution never has more towers than cells
+		self.tower_coords = np.empty((self.height * self.width, 4), dtype=np.int32)
+		# Buffers of _trim_kernel, shared by all Tower.trim calls
+		self._trim_cache = np.empty(self.width, dtype=np.int64)
+		self._trim_stack_x = np.empty(self.width + 1, dtype=np.int64)
+		self._trim_stack_h = np.empty(self.width + 1, dtype=np.int64)
+
 		self.clear()
 
+	def seed(self, seed=None):
+		"""Reseed all random numbers used by the solver
+
+		Args:
+		    seed (int, optional): The seed. If None, fresh entropy is taken
+		                          from the OS.
+		"""
+		# Random numbers for generate_random_tower are drawn in batches
+		self._rng = np.random.default_rng(seed)
+		self._rand_pool = []
+		self._rand_idx = 0
+
+		# Generator state for solve_once_nb
+		self._rng_state = self._rng.bit_generator.random_raw(2)
+
 	def clear(self):
-		self.coverage = np.zeros((self.height, self.width), dtype=np.uint)
+		self.coverage.fill(0)
+		self.free_mask.fill(1)
 		self.num_tower = 0
-		self.tower_list = []
+		self.uncovered_count = self.height * self.width
 
 	def create_tower(self, x1, x2, y1, y2):
 		"""Create a tower instance for the solver
@@ -55,10 +237,47 @@ class Solver:
 		# Argument checks are done by Tower.__init__
 		return Tower(self, x1, x2, y1, y2)
 
+	@property
+	def tower_list(self):
+		"""Returns the online towers, created from tower_coords
+
+		Returns:
+		    list: A list of online towers
+		"""
+		return [Tower(self, x1, x2, y1, y2, rank)
+			for rank, (x1, x2, y1, y2)
+			in enumerate(self.tower_coords[:self.num_tower].tolist(), 1)]
+
 	def dump_towers(self):
 		"""Render a string the rank and coordiantes of the towers"""
 		return "\n".join(tower.dump() for tower in self.tower_list)
 
+	def _generate_random_coordinates(self):
+		"""Generate the coordinates of a random tower. They are drawn in
+		batches and taken from the pool one at a time.
+
+		Returns:
+		    list: x1, x2, y1, y2 of the tower
+		"""
+		if self._rand_idx == len(self._rand_pool):
+			size = 4096
+			# Get random widths
+			widths = self._rng.integers(1, self.width + 1, size=size)
+			# Get random x1s
+			x1s = self._rng.integers(0, self.width - widths + 1)
+			# Get random heights
+			heights = self._rng.integers(1, self.height + 1, size=size)
+			# Get random y1s
+			y1s = self._rng.integers(0, self.height - heights + 1)
+
+			self._rand_pool = np.stack(
+				(x1s, x1s + widths, y1s, y1s + heights), axis=1).tolist()
+			self._rand_idx = 0
+
+		coordinates = self._rand_pool[self._rand_idx]
+		self._rand_idx += 1
+		return coordinates
+
 	def generate_random_tower(self):
 		"""Generate a random tower. Sizes are uniformly distributed, coordinates
 		are uniformly distributed.
@@ -66,21 +285,7 @@ class Solver:
 		Returns:
 		    Tower: The generated tower
 		"""
-		# Get a random width
-		width = random.randint(1, self.width)
-		# Get a random x1
-		x1 = random.randint(0, self.width - width)
-		# Get x2
-		x2 = x1 + width
-
-		# Get a random height
-		height = random.randint(1, self.height)
-		# Get a random y1
-		y1 = random.randint(0, self.height - height)
-		# Get y2
-		y2 = y1 + height
-
-		return self.create_tower(x1, x2, y1, y2)
+		return self.create_tower(*self._generate_random_coordinates())
 
 	def generate_random_valid_tower_untrimmed(self):
 		"""Generate a random tower whose area is not totally covered yet.
@@ -91,13 +296,14 @@ class Solver:
 		Raises:
 		    RuntimeError: The entire space has been covered
 		"""
-		if np.all(self.coverage):
+		if self.uncovered_count == 0:
 			raise RuntimeError ("The entire space has been covered")
 
-		tower = self.generate_random_tower()
-		while np.all(self.coverage[tower.mask]):
-			tower = self.generate_random_tower()
-		return tower
+		# Only the accepted candidate becomes a Tower
+		while True:
+			x1, x2, y1, y2 = self._generate_random_coordinates()
+			if self.free_mask[y1:y2, x1:x2].any():
+				return self.create_tower(x1, x2, y1, y2)
 
 	def generate_random_valid_tower_trimmed(self):
 		"""Generate a random tower whose area is not totally covered yet, and
@@ -110,6 +316,38 @@ class Solver:
 		tower.trim()
 		return tower
 
+	def _largest_empty_rect(self):
+		"""Find the largest uncovered rectangle of the entire space.
+
+		This is Tower.trim applied to a tower spanning the whole space.
+
+		Returns:
+		    Tower: A tower covering the largest uncovered rectangle
+
+		Raises:
+		    RuntimeError: The entire space has been covered
+		"""
+		if self.uncovered_count == 0:
+			raise RuntimeError ("The entire space has been covered")
+
+		tower = self.create_tower(0, self.width, 0, self.height)
+		tower.trim()
+		return tower
+
+	def place_largest_free_rect(self):
+		"""Add a tower on the largest uncovered rectangle. This is the
+		deterministic, greedy alternative to adding a random trimmed tower.
+
+		Returns:
+		    Tower: The added tower
+
+		Raises:
+		    RuntimeError: The entire space has been covered
+		"""
+		tower = self._largest_empty_rect()
+		self._add_tower_unchecked(tower)
+		return tower
+
 	def add_tower(self, tower):
 		"""Add a tower to the solution. Assign a rank to it and update solver's
 		states.
@@ -128,13 +366,26 @@ class Solver:
 			raise RuntimeError ("The tower %s was not created for the solver %s"
 				% (tower, self))
 
-		if np.any(self.coverage[tower.mask]):
+		sub_free = self.free_mask[tower.mask]
+		if np.count_nonzero(sub_free) != sub_free.size:
 			raise RuntimeError ("New tower overlaps with the current coverage")
 
+		self._add_tower_unchecked(tower)
+
+	def _add_tower_unchecked(self, tower):
+		"""Add a tower to the solution without the checks of add_tower. The
+		tower must be created for this solver and cover only uncovered cells,
+		e.g. a freshly trimmed tower.
+
+		Args:
+		    tower (Tower): The tower to be added
+		"""
+		self.uncovered_count -= (tower.x2 - tower.x1) * (tower.y2 - tower.y1)
+		self.tower_coords[self.num_tower] = (tower.x1, tower.x2, tower.y1, tower.y2)
 		self.num_tower += 1
 		tower.rank = self.num_tower
-		self.tower_list.append(tower)
 		self.coverage[tower.mask] = tower.rank
+		self.free_mask[tower.mask] = 0
 
 	def plot_coverage(self, im=None):
 		"""Plot the current coverage in a binary form.
@@ -148,6 +399,8 @@ class Solver:
 		Returns:
 		    AxiImage: The figure used to plot
 		"""
+		import matplotlib.pyplot as plt
+
 		data = self.coverage > 0
 		if im:
 			im.set_data(data)
@@ -165,7 +418,9 @@ class Solver:
 		Returns:
 		    AxiImage: The figure used to plot
 		"""
-		data = self.coverage.copy()
+		import matplotlib.pyplot as plt
+
+		data = self.coverage.astype(np.int32)
 		data[data != 0] += 8
 		vmax = max(8, np.max(data))
 		data[data == vmax] += 8
@@ -189,6 +444,8 @@ class Solver:
 		Returns:
 		    AxiImage: The figure used to plot
 		"""
+		import matplotlib.pyplot as plt
+
 		data = np.zeros_like(self.coverage)
 		data[self.coverage != 0] += 2
 		if tower_high:
@@ -208,20 +465,29 @@ class Solver:
 		    int: Number of tower used to cover the entire space.
 		"""
 		self.clear()
-		while not np.all(self.coverage):
-			self.add_tower(self.generate_random_valid_tower_trimmed())
+		self.num_tower = int(solve_once_nb(self.coverage, self.free_mask,
+			self.tower_coords, self.height, self.width, self._rng_state))
+		# The kernel always covers the entire space
+		self.uncovered_count = 0
 		return self.num_tower
 
 	def solve(self, times=1):
 		"""Solve the problem for multiple times, return a list of results
 
+		The runs are spread over all cores by solve_many_nb, each with a
+		generator state drawn from the solver's random numbers. Drawing them
+		advances those random numbers, but coverage, free_mask and
+		tower_coords are left untouched. Unlike solve_once, solve does not
+		leave the last solution in coverage.
+
 		Args:
 		    times (int, optional): Number of times to solve the problem
 
 		Returns:
 		    np.array: A list of results (number of towers)
 		"""
-		result = np.empty(times, dtype=np.int)
-		for index in xrange(times):
-			result[index] = self.solve_once()
+		result = np.empty(times, dtype=np.int32)
+		rng_states = self._rng.bit_generator.random_raw((times, 2))
+		solve_many_nb(self.coverage, self.height, self.width, rng_states, result,
+			min(get_num_threads(), times))
 		return result
@@ -0,0 +1,57 @@
+"""test_solver.py
+
+Regression tests for Solver. Run with pytest.
+"""
+import os
+import subprocess
+import sys
+import numpy as np
+import pytest
+from solver import Solver
+
+def test_solve_once_covers_entire_space():
+	solver = Solver(10, 10)
+	solver.solve_once()
+	assert np.all(solver.coverage)
+	assert solver.uncovered_count == 0
+	with pytest.raises(RuntimeError):
+		solver.generate_random_valid_tower_untrimmed()
+
+def test_tower_list_rebuilds_coverage():
+	solver = Solver(20, 20)
+	solver.solve_once()
+	towers = solver.tower_list
+	assert len(towers) == solver.num_tower
+	assert len(solver.dump_towers().splitlines()) == solver.num_tower
+	coverage = np.zeros_like(solver.coverage)
+	for tower in towers:
+		coverage[tower.mask] = tower.rank
+	assert np.array_equal(coverage, solver.coverage)
+
+def test_place_largest_free_rect_fills_space():
+	solver = Solver(20, 20)
+	solver.add_tower(solver.create_tower(7, 20, 2, 7))
+	solver.add_tower(solver.create_tower(1, 4, 6, 10))
+	while solver.uncovered_count > 0:
+		solver.place_largest_free_rect()
+	assert np.all(solver.coverage)
+	assert np.array_equal(solver.free_mask, solver.coverage == 0)
+	with pytest.raises(RuntimeError):
+		solver.place_largest_free_rect()
+
+def test_solve_is_reproducible():
+	first = Solver(10, 10, seed=1).solve(50)
+	second = Solver(10, 10, seed=1).solve(50)
+	assert np.array_equal(first, second)
+
+def test_solve_multiprocessing_after_solve():
+	# Solver.solve starts Numba's threads. A worker pool created afterwards
+	# must neither hang nor keep the interpreter from exiting.
+	code = (
+		"from solver import Solver\n"
+		"from solve_multiprocessing import solve_multiprocessing\n"
+		"if __name__ == '__main__':\n"
+		"    Solver(20, 20).solve(100)\n"
+		"    assert len(solve_multiprocessing(20, 20, 40)) == 40\n")
+	subprocess.run([sys.executable, "-c", code], check=True, timeout=60,
+		cwd=os.path.dirname(os.path.abspath(__file__)))
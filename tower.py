@@ -6,17 +6,83 @@ A99000241
 Provides Tower class to represent towers in the problem. Tower.trim is most
 important function.
 """
-import weakref
 import numpy as np
-import matplotlib.pyplot as plt
-import itertools
+from numba import njit
+
+@njit(cache=True)
+def _trim_kernel(sub_free, cache, stack_x, stack_h):
+	"""Find the largest uncovered rectangle of sub_free. This is the main loop
+	of Tower.trim, see it for the description of the algorithm.
+
+	Args:
+	    sub_free (np.ndarray): The free mask to search in. Non-zero means
+	                           uncovered
+	    cache (np.ndarray): Buffer of length sub_free.shape[1]
+	    stack_x (np.ndarray): Buffer of length sub_free.shape[1] + 1
+	    stack_h (np.ndarray): Buffer of length sub_free.shape[1] + 1
+
+	Returns:
+	    tuple: (x1, x2, y1, y2, area) of the rectangle relative to sub_free.
+	           area is -1 if sub_free is totally covered.
+	"""
+	height, width = sub_free.shape
+
+	# Initialize algorithm variables
+	cache[:] = 0
+	max_area = -1
+	max_x1 = max_x2 = max_y1 = max_y2 = 0
+	sp = 0
+
+	# Main loop
+	for yy in range(height):
+		current_height = 0
+		xx0 = height0 = 0
+		for xx in range(width + 1):
+			# Update the cache in the same pass
+			if xx < width:
+				if sub_free[yy, xx]:
+					cache[xx] += 1
+				else:
+					cache[xx] = 0
+				item = cache[xx]
+			else:
+				item = 0
+
+			if item > current_height:	# Opening new rectangle(s)?
+				stack_x[sp] = xx
+				stack_h[sp] = current_height
+				sp += 1
+				current_height = item
+			elif item < current_height:	# Closing rectangle(s)?
+				while item < current_height:
+					sp -= 1
+					xx0 = stack_x[sp]
+					height0 = stack_h[sp]
+					area = current_height * (xx - xx0)
+					if area > max_area:
+						max_area = area
+						max_x1, max_x2 = xx0, xx
+						max_y1, max_y2 = yy - current_height + 1, yy + 1
+					current_height = height0
+				if current_height != item:
+					current_height = item
+					if current_height:	# Popped an active opening?
+						stack_x[sp] = xx0
+						stack_h[sp] = height0
+						sp += 1
+
+	return max_x1, max_x2, max_y1, max_y2, max_area
 
 class Tower:
 
 	"""Tower class to represent towers for a specific solver instance
 
 	Attributes:
+	    mask (tuple): The index tuple to mask Solver's coverage array. For
+	                  example, solver.coverage[tower.mask] returns the
+	                  coverage area of the tower
 	    rank (int): The nth tower for the solver. None mean not yet assigned
+	    solver (Solver): The solver which the tower was created for
 	    x1 (int): x1 coordinate
 	    x2 (int): x2 coordinate
 	    y1 (int): y1 coordinate
@@ -38,7 +104,7 @@ class Tower:
 		    TypeError: Wrong argument types
 		    ValueError: Invalid arguments
 		"""
-		self._solver_weakref = weakref.ref(solver)
+		self.solver = solver
 
 		if not all(isinstance(coordinate, int) for coordinate in (x1, y1, x2, y2)):
 			raise TypeError ("All coordinates should be of type int")
@@ -52,6 +118,7 @@ class Tower:
 		self.x2 = x2
 		self.y1 = y1
 		self.y2 = y2
+		self.mask = (slice(y1, y2), slice(x1, x2))
 
 		self.rank = rank
 
@@ -79,27 +146,6 @@ class Tower:
 		"""
 		return "Rank: %(rank)s\tx1: %(x1)d\tx2: %(x2)d\ty1: %(y1)d\ty2: %(y2)d" % self.__dict__
 
-	@property
-	def mask(self):
-		"""Returns the slice object to mask Solver's coverage array
-
-		For example, solver.coverage[tower.mask] returns the coverage area of
-		the tower
-
-		Returns:
-		    tuple: A index tuple
-		"""
-		return np.s_[self.y1:self.y2, self.x1:self.x2]
-
-	@property
-	def solver(self):
-		"""Returns the solver which the tower was created for
-
-		Returns:
-		    Solver: The solver which the tower was created for
-		"""
-		return self._solver_weakref()
-
 	def is_for(self, solver):
 		"""Check if the tower was created for the solver
 
@@ -129,51 +175,30 @@ class Tower:
 		Raises:
 		    RuntimeError: Tower can not be trimmed. Totally covered.
 		"""
-		# Get sub-area
-		sub_array = self.solver.coverage[self.mask]
+		solver = self.solver
 
-		# Verify the sub-area
-		if np.all(sub_array):
-			raise RuntimeError ("The entire current space has been covered.")
+		# Get sub-area
+		sub_free = solver.free_mask[self.mask]
 
-		# Initialize algorithm variables
-		cache = np.zeros_like(sub_array[0])
-		max_area = -1
-		max_coordinates = (None, None, None, None)
-		stack = []
+		# Run the main loop with the solver's buffers
+		width = sub_free.shape[1]
+		x1, x2, y1, y2, area = _trim_kernel(sub_free, solver._trim_cache[:width],
+			solver._trim_stack_x, solver._trim_stack_h)
 
-		# Main loop
-		for yy, row in enumerate(sub_array):
-			cache += 1
-			cache[row != 0] = 0
-
-			current_height = 0
-			for xx, item in enumerate(itertools.chain(cache, (0,))):
-				if item > current_height:	# Opening new rectangle(s)?
-					stack.append((xx, current_height))
-					current_height = item
-				elif item < current_height:	# Closing rectangle(s)?
-					while item < current_height:
-						xx0, height0 = stack.pop()
-						area = current_height * (xx - xx0)
-						if area > max_area:
-							max_area = area
-							max_coordinates = (xx0, xx, int(yy - current_height + 1), yy + 1)
-						current_height = height0
-					if current_height != item:
-						current_height = item
-						if current_height:	# Popped an active opening?
-							stack.append((xx0, height0))
+		# Verify the sub-area. No rectangle is found if it is totally covered.
+		if area < 0:
+			raise RuntimeError ("The entire current space has been covered.")
 
 		# Update coordinates
-		self.x2 = self.x1 + max_coordinates[1]
-		self.x1 = self.x1 + max_coordinates[0]
-		self.y2 = self.y1 + max_coordinates[3]
-		self.y1 = self.y1 + max_coordinates[2]
+		self.x2 = self.x1 + x2
+		self.x1 = self.x1 + x1
+		self.y2 = self.y1 + y2
+		self.y1 = self.y1 + y1
+		self.mask = (slice(self.y1, self.y2), slice(self.x1, self.x2))
 
 		# Verify the output is valid
-		assert 0 <= self.x1 < self.x2 <= self.solver.width
-		assert 0 <= self.y1 < self.y2 <= self.solver.height
+		assert 0 <= self.x1 < self.x2 <= solver.width
+		assert 0 <= self.y1 < self.y2 <= solver.height
 
 	def trim_animation(self):
 		"""A generator to step through trim algorithm and plot the animation.
@@ -181,6 +206,8 @@ class Tower:
 		Yields:
 		    None: Each time when yield happens, the plot it updated.
 		"""
+		import matplotlib.pyplot as plt
+
 		def render_animation(examine=False, new_max=False):
 			"""Render one frame of the animation
 
@@ -254,9 +281,10 @@ class Tower:
 
 
 		# Get subarea
-		empty_space = self.solver.coverage[self.mask] == 0
+		empty_space = self.solver.free_mask[self.mask] != 0
 
 		# Initialize algorithm variables
+		width = empty_space.shape[1]
 		cache = np.zeros_like(empty_space[0], dtype=np.uint)
 		max_area = -1
 		max_coordinates = (None, None, None, None)
@@ -273,11 +301,12 @@ class Tower:
 		# Main loop
 		for yy, row in enumerate(empty_space):
 			cache += 1
-			cache[row == False] = 0
+			cache *= row
 
 			current_height = 0
 			yield render_animation()
-			for xx, item in enumerate(itertools.chain(cache, (0,))):
+			for xx in range(width + 1):
+				item = cache[xx] if xx < width else 0
 				if item > current_height:	# Opening new rectangle(s)?
 					stack.append((xx, current_height))
 					current_height = item